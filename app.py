@@ -18,6 +18,25 @@ from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 from reportlab.lib.units import inch
 from io import BytesIO
+import base64
+import gzip
+import hashlib
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import lru_cache
+from html import escape
+from string import Template
+import plotly.io as pio
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+try:
+    import pyarrow  # noqa: F401  (optional: compact Arrow-backed strings)
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
 
 # ✨ Footer (Dark mode friendly)
 # ---------------------------------------------------------------
@@ -67,6 +86,19 @@ TRANSLATIONS = {
         'theme': 'Dark Mode',
         'show_data': 'Show raw data',
         'download_pivot': 'Download Pivot as Excel',
+        'drilldown': 'Revenue Drill-down (branch → salesman → product)',
+        'drill_level': 'Expand',
+        'drill_all': '(all)',
+        'approx_mode': 'Approximate statistics (large datasets)',
+        'approx_note': 'Approximate values (≈) come from mergeable sketches; error bounds are shown per column.',
+        'top_values': 'Top values (approximate)',
+        'sketch_check': 'Sketch accuracy check (vs exact pandas on a sample)',
+        'run_sketch_check': 'Run accuracy check',
+        'compact_mode': 'Compact data in memory',
+        'memory_budget': 'Memory budget (MB, 0 = off) — compacts automatically above it',
+        'memory_report': 'Memory report (before / after compaction)',
+        'combine_series': 'Combine Y series in one figure',
+        'html_cdn': 'HTML report: load plotly.js from CDN (smaller file, needs internet)',
     },
     'ar': {
         'title': 'تحليلات ومؤشرات المبيعات والتنبؤ',
@@ -101,6 +133,19 @@ TRANSLATIONS = {
         'theme': 'الوضع الداكن',
         'show_data': 'عرض البيانات الخام',
         'download_pivot': 'تحميل الجدول المحوري كـ Excel',
+        'drilldown': 'تفصيل الإيرادات (الفرع ← المندوب ← الصنف)',
+        'drill_level': 'توسيع',
+        'drill_all': '(الكل)',
+        'approx_mode': 'إحصائيات تقريبية (للبيانات الكبيرة)',
+        'approx_note': 'القيم التقريبية (≈) محسوبة من ملخصات قابلة للدمج؛ حدود الخطأ معروضة لكل عمود.',
+        'top_values': 'القيم الأكثر تكرارًا (تقريبية)',
+        'sketch_check': 'فحص دقة الملخصات (مقارنة بالقيم الدقيقة على عينة)',
+        'run_sketch_check': 'تشغيل فحص الدقة',
+        'compact_mode': 'ضغط البيانات في الذاكرة',
+        'memory_budget': 'حد الذاكرة (ميجابايت، 0 = معطل) — يتم الضغط تلقائيًا عند تجاوزه',
+        'memory_report': 'تقرير الذاكرة (قبل / بعد الضغط)',
+        'combine_series': 'دمج سلاسل المحور الصادي في مخطط واحد',
+        'html_cdn': 'تقرير HTML: تحميل plotly.js من الإنترنت (ملف أصغر)',
     }
 }
 
@@ -135,6 +180,15 @@ def read_file(uploaded_file):
             st.error("⚠️ Could not read file. Please upload a valid Excel or CSV file.")
             return None
 
+    df, _ = _clean_frame(df)
+    return df
+
+def _clean_frame(df: pd.DataFrame):
+    """Header detection and cleaning for a raw (header=None) sheet.
+
+    Returns the cleaned frame and its layout `(kept_columns, names)`, so
+    later chunks of the same CSV can be cleaned with `_apply_layout`.
+    """
     # Drop completely empty rows and columns
     df = df.dropna(how='all').dropna(axis=1, how='all')
 
@@ -152,16 +206,27 @@ def read_file(uploaded_file):
         if header_row is None:
             header_row = 0
 
+    kept_columns = list(df.columns)
     df.columns = df.iloc[header_row].astype(str).str.strip()
     df = df.iloc[header_row + 1:].reset_index(drop=True)
 
     # Clean column names: replace Unnamed or blanks with Column_i
-    df.columns = [
+    names = [
         col if (isinstance(col, str) and col.strip() != "" and not col.strip().startswith("Unnamed"))
         else f"Column_{i}"
         for i, col in enumerate(df.columns)
     ]
+    df.columns = names
+    return _finish_frame(df), (kept_columns, names)
+
+def _apply_layout(raw: pd.DataFrame, layout) -> pd.DataFrame:
+    """Clean a later raw CSV chunk with the layout detected on the first one."""
+    kept_columns, names = layout
+    df = raw.reindex(columns=kept_columns)
+    df.columns = names
+    return _finish_frame(df)
 
+def _finish_frame(df: pd.DataFrame) -> pd.DataFrame:
     # Drop empty rows after cleaning
     df = df.dropna(how="all").reset_index(drop=True)
 
@@ -205,12 +270,755 @@ def generate_pivot(df, rows, cols, values, aggfunc):
     func = agg_map.get(aggfunc, np.sum)
     try:
         pvt = pd.pivot_table(df, index=rows if rows else None, columns=cols if cols else None,
-                             values=values if values else None, aggfunc=func, margins=True)
+                             values=values if values else None, aggfunc=func, margins=True,
+                             observed=True)
         return pvt
     except Exception as e:
         st.error(f"Pivot error: {e}")
         return None
 
+def safe_find(df, possible_names):
+    """Return the first column matching one of the names (Arabic or English)."""
+    for name in possible_names:
+        for col in df.columns:
+            if str(col).strip().lower() == str(name).strip().lower():
+                return col
+    return None
+
+def build_rollup(df: pd.DataFrame, levels: tuple, value_col: str):
+    """Sum `value_col` over the `levels` hierarchy with one sort pass.
+
+    Returns a flat dict keyed by path tuple (`()` is the grand total,
+    `(branch,)`, `(branch, salesman)`, ...). Each node holds its total,
+    row count and the paths of its children, so every level of the tree
+    is served without grouping the raw data again. The tree is cached as
+    part of `compute_insights`, for the latest dataset only.
+    """
+    levels = list(levels)
+    data = df[levels + [value_col]].copy()
+    data[value_col] = pd.to_numeric(data[value_col], errors='coerce').fillna(0)
+    for c in levels:
+        data[c] = data[c].astype(object).fillna('—').astype(str)
+    data = data.sort_values(levels, kind='mergesort')
+
+    values = data[value_col].to_numpy(dtype=float)
+    keys = [data[c].to_numpy() for c in levels]
+    n = len(values)
+    tree = {(): {'total': float(values.sum()), 'count': n, 'children': []}}
+    if n == 0:
+        return tree
+
+    # A group at depth d starts wherever any key up to d changes.
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    for depth, col_keys in enumerate(keys):
+        change[1:] |= col_keys[1:] != col_keys[:-1]
+        starts = np.flatnonzero(change)
+        ends = np.append(starts[1:], n)
+        totals = np.add.reduceat(values, starts)
+        for s, e, total in zip(starts, ends, totals):
+            path = tuple(k[s] for k in keys[:depth + 1])
+            tree[path] = {'total': float(total), 'count': int(e - s), 'children': []}
+            tree[path[:-1]]['children'].append(path)
+    return tree
+
+def rollup_children(tree: dict, path: tuple, label: str):
+    """Table of the children of `path` in a rollup tree, largest first."""
+    node = tree.get(path)
+    if node is None or not node['children']:
+        return pd.DataFrame()
+    parent_total = node['total']
+    rows = [
+        {
+            label: child[-1],
+            'Total': tree[child]['total'],
+            'Rows': tree[child]['count'],
+            'Share %': (tree[child]['total'] / parent_total * 100) if parent_total else 0.0,
+        }
+        for child in node['children']
+    ]
+    return pd.DataFrame(rows).sort_values('Total', ascending=False).reset_index(drop=True)
+
+# ---------------- Approximate (streaming) statistics ----------------
+# Mergeable sketches: each one can be updated chunk by chunk and combined
+# with another sketch of the same kind (other chunks or other files).
+
+class KLLSketch:
+    """KLL quantile sketch. Rank error is roughly 1.7 / k."""
+
+    def __init__(self, k: int = 200, seed: int = 0):
+        self.k = k
+        self.n = 0
+        self.compactors = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        done = False
+        while not done:
+            done = True
+            for level in range(len(self.compactors)):
+                buf = self.compactors[level]
+                if len(buf) <= self._capacity(level):
+                    continue
+                done = False
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                buf = np.sort(buf)
+                keep = buf[-1:] if len(buf) % 2 else buf[:0]
+                buf = buf[:len(buf) - len(keep)]
+                promoted = buf[self._rng.integers(2)::2]
+                self.compactors[level] = keep
+                self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], promoted])
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.compactors[0] = np.concatenate([self.compactors[0], values])
+        self._compress()
+
+    def merge(self, other: 'KLLSketch'):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, buf in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], buf])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def quantile(self, q: float) -> float:
+        if self.n == 0:
+            return np.nan
+        items = np.concatenate(self.compactors)
+        weights = np.concatenate([np.full(len(buf), 2.0 ** level) for level, buf in enumerate(self.compactors)])
+        order = np.argsort(items, kind='mergesort')
+        cum = np.cumsum(weights[order])
+        idx = min(np.searchsorted(cum, q * cum[-1]), len(items) - 1)
+        return float(items[order][idx])
+
+    @property
+    def rank_error(self) -> float:
+        return 1.7 / self.k
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter. Relative error is about 1.04 / sqrt(2**p)."""
+
+    def __init__(self, p: int = 14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    def update(self, values):
+        values = pd.Series(values).dropna()
+        if values.empty:
+            return
+        h = pd.util.hash_array(values.to_numpy())
+        tail_bits = 64 - self.p
+        idx = (h >> np.uint64(tail_bits)).astype(np.int64)
+        tail = (h & np.uint64((1 << tail_bits) - 1)).astype(float)
+        # frexp gives floor(log2(tail)) + 1 exactly; tail == 0 yields exponent 0.
+        rank = (tail_bits - np.frexp(tail)[1] + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other: 'HyperLogLog'):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)
+        return float(estimate)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / np.sqrt(len(self.registers))
+
+
+class FrequentItems:
+    """Mergeable Misra-Gries summary of the most frequent values.
+
+    Counts are underestimates by at most `error` (which never exceeds
+    n / (capacity + 1)).
+    """
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counters = pd.Series(dtype=float)
+        self.error = 0.0
+
+    def _reduce(self):
+        if len(self.counters) <= self.capacity:
+            return
+        cut = self.counters.nlargest(self.capacity + 1).iloc[-1]
+        self.counters = self.counters[self.counters > cut] - cut
+        self.error += float(cut)
+
+    def update(self, values):
+        chunk_counts = pd.Series(values).dropna().astype(str).value_counts()
+        self.counters = self.counters.add(chunk_counts, fill_value=0)
+        self._reduce()
+
+    def merge(self, other: 'FrequentItems'):
+        self.counters = self.counters.add(other.counters, fill_value=0)
+        self.error += other.error
+        self._reduce()
+        return self
+
+    def top(self, n: int = 5) -> pd.Series:
+        return self.counters.nlargest(n)
+
+
+class ColumnSketch:
+    """All sketches kept for one column: exact moments/min/max plus quantiles,
+    distinct count and (for text columns) frequent values."""
+
+    def __init__(self, numeric: bool):
+        self.numeric = numeric
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.quantiles = KLLSketch() if numeric else None
+        self.distinct = HyperLogLog()
+        self.frequent = None if numeric else FrequentItems()
+
+    def _merge_moments(self, count, mean, m2):
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def update(self, values: pd.Series):
+        self.distinct.update(values)
+        if self.numeric:
+            vals = pd.to_numeric(values, errors='coerce').dropna().to_numpy(dtype=float)
+            if len(vals):
+                self._merge_moments(len(vals), vals.mean(), ((vals - vals.mean()) ** 2).sum())
+                self.min = min(self.min, vals.min())
+                self.max = max(self.max, vals.max())
+                self.quantiles.update(vals)
+        else:
+            self.count += int(values.notna().sum())
+            self.frequent.update(values)
+
+    def merge(self, other: 'ColumnSketch'):
+        if self.numeric:
+            self._merge_moments(other.count, other.mean, other.m2)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self.quantiles.merge(other.quantiles)
+        else:
+            self.count += other.count
+            self.frequent.merge(other.frequent)
+        self.distinct.merge(other.distinct)
+        return self
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+
+def is_stats_numeric(s: pd.Series) -> bool:
+    """Same rule as `stats_summary` (`select_dtypes(include=[np.number])`): bools are not numeric."""
+    return pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s)
+
+def merge_sketches(left: dict, right: dict) -> dict:
+    """Combine two {column: ColumnSketch} maps built from different chunks."""
+    merged = dict(left)
+    for col, sk in right.items():
+        merged[col] = merged[col].merge(sk) if col in merged else sk
+    return merged
+
+def _sketch_chunk(chunk: pd.DataFrame, kinds: dict) -> dict:
+    part = {}
+    for col in chunk.columns:
+        sk = ColumnSketch(numeric=kinds.get(col, False))
+        sk.update(chunk[col])
+        part[col] = sk
+    return part
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def build_sketches(df: pd.DataFrame, chunk_rows: int = 100_000) -> dict:
+    """Build per-column sketches from an already loaded frame, chunk by chunk.
+
+    Used for Excel files and the sample data. A single build costs more
+    than the exact statistics; the savings come from cached reruns and
+    from `read_csv_with_sketches`, which sketches CSVs while reading them.
+    """
+    kinds = {col: is_stats_numeric(df[col]) for col in df.columns}
+    sketches = {}
+    for start in range(0, len(df), chunk_rows):
+        sketches = merge_sketches(sketches, _sketch_chunk(df.iloc[start:start + chunk_rows], kinds))
+    return sketches
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def read_csv_with_sketches(data: bytes, chunk_rows: int = 200_000):
+    """Read a CSV in chunks and sketch each chunk as it arrives.
+
+    The header is detected on the first chunk (as `read_file` does for the
+    whole file) and reused for the rest. Cells are read as text, like the
+    whole-file read where the header row makes every column text, so each
+    chunk gets the same numeric conversion. Column kinds are fixed by the first
+    chunk so every chunk's sketches can be merged. Returns `(df, sketches)`,
+    or `(None, None)` when the file cannot be parsed.
+    """
+    try:
+        frames, sketches, layout, kinds = [], {}, None, None
+        for raw in pd.read_csv(io.BytesIO(data), header=None, encoding='utf-8', dtype=str,
+                               chunksize=chunk_rows):
+            if layout is None:
+                chunk, layout = _clean_frame(raw)
+                kinds = {col: is_stats_numeric(chunk[col]) for col in chunk.columns}
+            else:
+                chunk = _apply_layout(raw, layout)
+            frames.append(chunk)
+            sketches = merge_sketches(sketches, _sketch_chunk(chunk, kinds))
+    except Exception:
+        return None, None
+    if not frames:
+        return None, None
+    return pd.concat(frames, ignore_index=True), sketches
+
+def sketch_accuracy(df: pd.DataFrame, sample_rows: int = 200_000, seed: int = 0):
+    """Compare freshly built sketches with exact pandas results on a sample.
+
+    Returns one row per check with the observed error and the stated bound
+    (KLL rank error 1.7/k, HyperLogLog standard error 1.04/sqrt(m), and the
+    Misra-Gries undercount bound).
+    """
+    sample = df.sample(n=min(sample_rows, len(df)), random_state=seed) if len(df) else df
+    rows = []
+    for col in sample.columns:
+        values = sample[col]
+        sk = ColumnSketch(numeric=is_stats_numeric(values))
+        sk.update(values)
+        exact_distinct = values.nunique(dropna=True)
+        if exact_distinct:
+            rows.append({'Column': col, 'Check': 'distinct count',
+                         'Observed err': abs(sk.distinct.count() - exact_distinct) / exact_distinct,
+                         'Stated bound': sk.distinct.relative_error})
+        if sk.numeric:
+            vals = pd.to_numeric(values, errors='coerce').dropna()
+            if len(vals):
+                median = sk.quantiles.quantile(0.5)
+                lo, hi = (vals < median).mean(), (vals <= median).mean()
+                rank_err = 0.0 if lo <= 0.5 <= hi else min(abs(lo - 0.5), abs(hi - 0.5))
+                rows.append({'Column': col, 'Check': 'median rank',
+                             'Observed err': rank_err, 'Stated bound': sk.quantiles.rank_error})
+        else:
+            exact = values.dropna().astype(str).value_counts()
+            top = sk.frequent.top(5)
+            if len(top):
+                undercount = (exact.reindex(top.index) - top).max()
+                rows.append({'Column': col, 'Check': 'top-value count',
+                             'Observed err': float(undercount) / len(values),
+                             'Stated bound': sk.frequent.error / len(values)})
+    report = pd.DataFrame(rows)
+    if not report.empty:
+        # HyperLogLog's bound is a standard error, so allow 3 sigma
+        slack = np.where(report['Check'] == 'distinct count', 3.0, 1.0)
+        report['Within bound'] = report['Observed err'] <= report['Stated bound'] * slack + 1e-12
+    return report
+
+def approx_stats_summary(sketches: dict):
+    """Same shape as `stats_summary`, with an approximate median and its error bound."""
+    rows = {}
+    for col, sk in sketches.items():
+        if not sk.numeric or sk.count == 0:
+            continue
+        rows[col] = {
+            'count': sk.count,
+            'mean': sk.mean,
+            'median ≈': sk.quantiles.quantile(0.5),
+            'max': sk.max,
+            'min': sk.min,
+            'dev': sk.std,
+            'median rank err ±%': sk.quantiles.rank_error * 100,
+            'distinct ≈': round(sk.distinct.count()),
+            'distinct err ±%': sk.distinct.relative_error * 100,
+        }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+# ---------------- Memory compaction ----------------
+
+def _compact_series(s: pd.Series, category_ratio: float) -> pd.Series:
+    """Return `s` in the smallest dtype that holds the same values."""
+    if pd.api.types.is_bool_dtype(s) or pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    if pd.api.types.is_numeric_dtype(s):
+        if pd.api.types.is_integer_dtype(s):
+            return pd.to_numeric(s, downcast='unsigned' if s.min() >= 0 else 'integer')
+        whole = s.dropna()
+        if len(whole) and (whole % 1 == 0).all() and whole.abs().max() < 2 ** 53:
+            # Integral floats become (nullable, if there are blanks) integers,
+            # which pandas still sums exactly
+            ints = s.astype('Int64') if s.isna().any() else s.astype(np.int64)
+            return pd.to_numeric(ints, downcast='unsigned' if whole.min() >= 0 else 'integer')
+        # Fractional floats stay float64: float32 sums drift on large frames
+        return s
+    if s.dtype == object or isinstance(s.dtype, pd.StringDtype):
+        n = len(s)
+        if n and s.nunique(dropna=True) <= category_ratio * n:
+            return s.astype('category')
+        if HAS_PYARROW and s.dtype == object and s.dropna().map(type).eq(str).all():
+            return s.astype('string[pyarrow]')
+    return s
+
+def compact_dataframe(df: pd.DataFrame, category_ratio: float = 0.5):
+    """Downcast integer(-valued) columns and turn repeated strings into
+    categoricals (or Arrow strings). Fractional floats keep float64 so totals
+    do not change. Sparse storage is not used: sparse arrays lack the
+    median/std reductions the stats use, so mostly-empty float columns
+    stay at full size.
+
+    Returns the compacted frame and a per-column before/after memory report.
+    """
+    before = df.memory_usage(deep=True, index=False)
+    out = pd.DataFrame({c: _compact_series(df[c], category_ratio) for c in df.columns})
+    after = out.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'dtype before': df.dtypes.astype(str),
+        'dtype after': out.dtypes.astype(str),
+        'MB before': before / 1024 ** 2,
+        'MB after': after / 1024 ** 2,
+    })
+    report['saved %'] = (1 - report['MB after'] / report['MB before'].where(report['MB before'] > 0)) * 100
+    report.loc['TOTAL'] = ['', '', report['MB before'].sum(), report['MB after'].sum(),
+                           (1 - after.sum() / before.sum()) * 100 if before.sum() else 0.0]
+    return out, report
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _compact_cached(df: pd.DataFrame):
+    return compact_dataframe(df)
+
+def compact_if_needed(df: pd.DataFrame, budget_mb: float, force: bool):
+    """Compact `df` when forced or when it exceeds `budget_mb` (0 disables the budget).
+
+    Only the compacted result is cached, and only for the latest dataset, so
+    the raw frame is never kept around as an extra copy.
+    """
+    size_mb = df.memory_usage(deep=True).sum() / 1024 ** 2
+    if force or (budget_mb and size_mb > budget_mb):
+        return _compact_cached(df)
+    return df, None
+
+# ---------------- Concurrent sections ----------------
+
+# Seconds each concurrent section may take before its slot shows a timeout
+SECTION_TIMEOUTS = {
+    'totals': 15,
+    'missing': 15,
+    'stats': 60,
+    'correlations': 60,
+    'insights': 120,
+}
+
+@st.cache_resource
+def _section_pool(max_workers: int = 4) -> ThreadPoolExecutor:
+    """One thread pool shared by every rerun and session, so the number of
+    section threads stays bounded no matter how often the script reruns."""
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='section')
+
+def _with_script_ctx(fn, ctx):
+    # Workers borrow the submitting script's run context so st.cache_data works inside them.
+    def run():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fn()
+    return run
+
+class SectionExecutor:
+    """Run independent dashboard sections on the shared section thread pool.
+
+    Work starts as soon as the executor is created; `as_completed()` then
+    yields `(name, result, error)` in completion order. A section that
+    raises or exceeds its timeout yields an error instead of a result, so
+    one bad section never takes the others down with it.
+
+    Python threads cannot be interrupted: a section that times out keeps
+    running in the background until it finishes, occupying one pool worker,
+    and its result is discarded. Sections that have not started yet are
+    cancelled once the page no longer waits for them.
+    """
+
+    def __init__(self, tasks: dict, timeouts: dict = None, default_timeout: float = 60.0):
+        pool = _section_pool()
+        ctx = get_script_run_ctx()
+        start = time.monotonic()
+        timeouts = timeouts or {}
+        self._pending = {pool.submit(_with_script_ctx(fn, ctx)): name for name, fn in tasks.items()}
+        self._deadlines = {f: start + timeouts.get(name, default_timeout) for f, name in self._pending.items()}
+
+    def as_completed(self):
+        try:
+            while self._pending:
+                # Hand out finished sections first, so one that completed while
+                # the script thread was busy is never reported as timed out.
+                for f in [f for f in self._pending if f.done()]:
+                    name = self._pending.pop(f)
+                    try:
+                        yield name, f.result(), None
+                    except Exception as e:
+                        yield name, None, e
+                now = time.monotonic()
+                for f in [f for f in self._pending if self._deadlines[f] <= now and not f.done()]:
+                    f.cancel()  # only stops sections still queued; running ones finish in the background
+                    yield self._pending.pop(f), None, TimeoutError('section timed out')
+                if not self._pending:
+                    break
+                next_deadline = min(self._deadlines[f] for f in self._pending)
+                wait(self._pending, timeout=max(next_deadline - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        finally:
+            for f in self._pending:
+                f.cancel()
+
+def correlation_matrix(df: pd.DataFrame):
+    num_df = df.select_dtypes(include=[np.number])
+    return num_df.corr() if num_df.shape[1] >= 2 else None
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def compute_insights(df: pd.DataFrame) -> dict:
+    """Detect the key sales columns and compute the automated insights.
+
+    Cached per dataset, so reruns triggered by the drill-down selectors
+    reuse these group-bys instead of scanning the raw data again.
+    """
+    insights = []
+    insights_dict = {}
+
+    # --- Detect key columns dynamically ---
+    revenue_col = safe_find(df, ["القيمة بعد الضريبة", "صافي المبيعات", "الإيرادات", "revenue", "total revenue"])
+    discount_col = safe_find(df, ["الخصومات", "خصم", "discount", "total discount"])
+    tax_col = safe_find(df, ["الضريبة", "ضريبة الصنف", "tax", "total tax"])
+    qty_col = safe_find(df, ["الكمية", "كمية كرتون", "quantity", "total quantity"])
+    branch_col = safe_find(df, ["الفرع", "branch"])
+    salesman_col = safe_find(df, ["اسم المندوب", "مندوب", "salesman"])
+    product_col = safe_find(df, ["اسم الصنف", "الصنف", "product"])
+
+    # --- Calculate totals ---
+    if revenue_col in df.columns:
+        total_revenue = df[revenue_col].sum()
+        insights_dict["Total Revenue"] = f"{total_revenue:,.2f}"
+        insights.append(f"💰 Total Revenue: {total_revenue:,.2f}")
+
+    if discount_col in df.columns:
+        total_discount = df[discount_col].sum()
+        insights_dict["Total Discounts"] = f"{total_discount:,.2f}"
+        insights.append(f"🎯 Total Discounts: {total_discount:,.2f}")
+
+    if tax_col in df.columns:
+        total_tax = df[tax_col].sum()
+        insights_dict["Total Tax"] = f"{total_tax:,.2f}"
+        insights.append(f"💸 Total Tax: {total_tax:,.2f}")
+
+    if qty_col in df.columns:
+        total_qty = df[qty_col].sum()
+        insights_dict["Total Quantity"] = f"{total_qty:,.2f}"
+        insights.append(f"📦 Total Quantity: {total_qty:,.2f}")
+
+    # --- Find top categories ---
+    branch_revenue = None
+    if branch_col in df.columns and revenue_col in df.columns:
+        branch_revenue = df.groupby(branch_col, observed=True)[revenue_col].sum()
+        top_branch = branch_revenue.idxmax()
+        insights_dict["Top Branch by Revenue"] = str(top_branch)
+        insights.append(f"🏢 Top Branch by Revenue: {top_branch}")
+
+    if salesman_col in df.columns and revenue_col in df.columns:
+        top_salesman = df.groupby(salesman_col, observed=True)[revenue_col].sum().idxmax()
+        insights_dict["Top Salesman"] = str(top_salesman)
+        insights.append(f"🧍‍♂️ Top Salesman: {top_salesman}")
+
+    if product_col in df.columns and revenue_col in df.columns:
+        top_product = df.groupby(product_col, observed=True)[revenue_col].sum().idxmax()
+        insights_dict["Top Product"] = str(top_product)
+        insights.append(f"🛒 Top Product: {top_product}")
+
+    # --- Optional correlation check (for numeric relationships) ---
+    num = df.select_dtypes(include=[np.number])
+    if num.shape[1] >= 2:
+        corr = num.corr().abs()
+        corr_unstack = corr.where(~np.eye(corr.shape[0], dtype=bool)).unstack().dropna()
+        if not corr_unstack.empty:
+            top_pair = corr_unstack.sort_values(ascending=False).index[0]
+            top_val = corr_unstack.sort_values(ascending=False).iloc[0]
+            insights.append(f"📈 Strongest correlation between **{top_pair[0]}** and **{top_pair[1]}**: {top_val:.2f}")
+
+    # --- Drill-down rollup (branch → salesman → product) ---
+    drill_levels = [c for c in (branch_col, salesman_col, product_col) if c in df.columns]
+    tree = None
+    if revenue_col in df.columns and drill_levels:
+        tree = build_rollup(df, tuple(drill_levels), revenue_col)
+
+    return {
+        'insights': insights,
+        'insights_dict': insights_dict,
+        'revenue_col': revenue_col,
+        'branch_col': branch_col,
+        'branch_revenue': branch_revenue,
+        'drill_levels': drill_levels,
+        'tree': tree,
+    }
+
+def render_insights(result: dict):
+    """Display the output of `compute_insights` (must run on the script thread)."""
+    insights = result['insights']
+    insights_dict = result['insights_dict']
+    revenue_col = result['revenue_col']
+    branch_col = result['branch_col']
+
+    # --- Display the results ---
+    st.markdown("### 📊 Summary of Key Metrics")
+    col1, col2 = st.columns([1.3, 2])
+
+    # --- Left: Table of metrics ---
+    with col1:
+        if insights_dict:
+            insights_df = pd.DataFrame(list(insights_dict.items()), columns=["Metric", "Value"])
+            st.table(insights_df)
+        else:
+            st.info("⚠️ لم يتم العثور على بيانات كافية لإنشاء التحليل التلقائي.")
+
+    # --- Right: Textual insights ---
+    with col2:
+        st.markdown("### 💡 Key Observations")
+        for ins in insights:
+            st.write("- ", ins)
+
+    # --- Chart: Revenue by Branch (if available) ---
+    if result['branch_revenue'] is not None:
+        st.markdown("### 🏢 Revenue by Branch")
+        fig = px.bar(
+            result['branch_revenue'].reset_index(),
+            x=branch_col,
+            y=revenue_col,
+            title="Branch Performance",
+            color=branch_col,
+            text_auto=".2s"
+        )
+        fig.update_layout(showlegend=False)
+        st.plotly_chart(fig, use_container_width=True)
+
+    # --- Drill-down: branch → salesman → product (served from cached rollup) ---
+    tree = result['tree']
+    drill_levels = result['drill_levels']
+    if tree is not None:
+        st.markdown("### 🔎 " + t('drilldown'))
+        path = ()
+        for depth, level in enumerate(drill_levels):
+            children = rollup_children(tree, path, level)
+            if children.empty:
+                break
+            st.dataframe(children, use_container_width=True)
+            if depth == len(drill_levels) - 1:
+                break
+            choice = st.selectbox(
+                f"{t('drill_level')} {level}",
+                options=[t('drill_all')] + children[level].tolist(),
+                key=f"drill_{depth}",
+            )
+            if choice == t('drill_all'):
+                break
+            path = path + (choice,)
+
+# ---------------- Chart figures ----------------
+
+def dataset_fingerprint(df: pd.DataFrame) -> str:
+    """Stable content hash of a dataset, used as a cache key for figures."""
+    h = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    h.update(repr(list(df.columns)).encode('utf-8'))
+    return h.hexdigest()
+
+_PLOTLY_TYPED_DTYPES = {'int8', 'uint8', 'int16', 'uint16', 'int32', 'uint32', 'float32', 'float64'}
+
+def _plot_array(s: pd.Series):
+    """Column values as a compact numpy array.
+
+    Plotly serializes numeric numpy arrays as base64 typed arrays rather than
+    JSON number lists. Widths plotly.js has typed arrays for (e.g. the
+    uint8/int16 columns produced by compaction) are kept as they are; 64-bit
+    integers, which plotly.js cannot hold, are narrowed to 32 bits when the
+    values fit and sent as float64 otherwise.
+    """
+    if pd.api.types.is_bool_dtype(s) or not pd.api.types.is_numeric_dtype(s):
+        return s.to_numpy()
+    if str(s.dtype) in _PLOTLY_TYPED_DTYPES:
+        return s.to_numpy()
+    values = s.to_numpy(dtype=float, na_value=np.nan)
+    if pd.api.types.is_integer_dtype(s) and not np.isnan(values).any() and len(values):
+        if values.min() >= 0 and values.max() < 2 ** 32:
+            return values.astype(np.uint32)
+        if np.abs(values).max() < 2 ** 31:
+            return values.astype(np.int32)
+    if s.dtype == np.float16:
+        return values.astype(np.float32)
+    return values
+
+def _xy_trace(chart_type: str, x, y, name: str):
+    if chart_type == 'Bar':
+        return go.Bar(x=x, y=y, name=name)
+    if chart_type == 'Area':
+        return go.Scatter(x=x, y=y, name=name, mode='lines', stackgroup='one')
+    return go.Scatter(x=x, y=y, name=name, mode='markers' if chart_type == 'Scatter' else 'lines')
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=3600)
+def build_chart_figures(_df: pd.DataFrame, dataset_key: str, chart_type: str, x_col, y_cols: tuple, combine: bool):
+    """Build (and cache) the Charts-section figures for one chart spec.
+
+    The cache key is the dataset fingerprint plus the spec, so `_df` itself
+    is not hashed. With `combine`, all Y series go into one figure that
+    reuses the same x array.
+    """
+    df = _df
+    if chart_type in ('Line', 'Bar', 'Area', 'Scatter'):
+        x = _plot_array(df[x_col])
+        traces = [_xy_trace(chart_type, x, _plot_array(df[y_col]), str(y_col)) for y_col in y_cols]
+        if combine:
+            fig = go.Figure(data=traces)
+            fig.update_layout(title=f"{chart_type} Chart - {', '.join(map(str, y_cols))}", xaxis_title=x_col)
+            return [fig]
+        figs = []
+        for y_col, trace in zip(y_cols, traces):
+            fig = go.Figure(data=[trace])
+            fig.update_layout(title=f"{chart_type} Chart - {y_col}", xaxis_title=x_col, yaxis_title=y_col)
+            figs.append(fig)
+        return figs
+
+    if chart_type == 'Box':
+        fig = go.Figure(data=[go.Box(y=_plot_array(df[y_col]), name=str(y_col)) for y_col in y_cols])
+        return [fig]
+
+    if chart_type == 'Pie':
+        # Pre-aggregate so the figure carries one value per slice, not per row
+        figs = []
+        for y_col in y_cols:
+            slices = df.groupby(x_col, observed=True)[y_col].sum()
+            fig = go.Figure(data=go.Pie(labels=slices.index.astype(str), values=_plot_array(slices)))
+            fig.update_layout(title=f"مخطط دائري: {y_col}")
+            figs.append(fig)
+        return figs
+
+    if chart_type == 'Heatmap':
+        corr = df.select_dtypes(include=[np.number]).corr()
+        fig = go.Figure(data=go.Heatmap(z=corr.to_numpy(), x=corr.columns, y=corr.index, zmin=-1, zmax=1))
+        fig.update_layout(title="خريطة الارتباط الحرارية")
+        return [fig]
+
+    return []
+
 def df_to_excel_bytes(sheets: dict):
     out = io.BytesIO()
     with pd.ExcelWriter(out, engine='xlsxwriter') as writer:
@@ -223,17 +1031,171 @@ def df_to_excel_bytes(sheets: dict):
     out.seek(0)
     return out
 
-def create_html_report(df: pd.DataFrame, insights: list):
-    html = '<html><head><meta charset="utf-8"><title>Report</title></head><body>'
-    html += f'<h1>{t("title")}</h1>'
-    html += f'<p>Generated: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>'
-    html += f'<h2>Dataset</h2><p>Rows: {df.shape[0]} | Columns: {df.shape[1]}</p>'
-    html += '<h3>Insights</h3><ul>'
-    for ins in insights:
-        html += f'<li>{ins}</li>'
-    html += '</ul>'
-    html += '</body></html>'
-    return html.encode('utf-8')
+# ---------------- HTML dashboard report ----------------
+# Templates are compiled once at import. Chart data is embedded as
+# gzip+base64 plotly JSON (already aggregated/downsampled), and plotly.js is
+# included a single time for all charts.
+
+_REPORT_TEMPLATE = Template("""<!DOCTYPE html>
+<html lang="$lang" dir="$direction"><head><meta charset="utf-8"><title>$title</title>
+<style>
+body { font-family: Arial, sans-serif; margin: 24px; color: #1f2933; }
+.muted { color: #777; }
+.kpis { display: flex; flex-wrap: wrap; gap: 12px; }
+.kpi { border: 1px solid #ddd; border-radius: 8px; padding: 10px 16px; min-width: 160px; }
+.kpi b { display: block; font-size: 20px; }
+table { border-collapse: collapse; font-size: 13px; margin: 8px 0; }
+th, td { border: 1px solid #ddd; padding: 4px 8px; }
+.chart { width: 100%; min-height: 420px; }
+</style>
+$plotly
+</head><body>
+<h1>$title</h1>
+<p class="muted">Generated: $generated | Rows: $rows | Columns: $columns</p>
+$sections
+<script>$loader</script>
+</body></html>""")
+
+_SECTION_TEMPLATE = Template('<section><h2>$heading</h2>$body</section>')
+_FIGURE_TEMPLATE = Template('<div class="chart" data-figure="$payload"></div>')
+_KPI_TEMPLATE = Template('<div class="kpi">$label<b>$value</b></div>')
+_BOLD_RE = re.compile(r'\*\*(.+?)\*\*')
+
+# Inflates each embedded figure in the browser and draws it with the shared plotly.js
+_FIGURE_LOADER = """
+async function inflateFigure(b64) {
+  const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+  const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+  return JSON.parse(await new Response(stream).text());
+}
+document.querySelectorAll('[data-figure]').forEach(async el => {
+  const fig = await inflateFigure(el.dataset.figure);
+  Plotly.newPlot(el, fig.data, fig.layout, {responsive: true});
+});
+"""
+
+@lru_cache(maxsize=1)
+def _plotly_bundle(source: str) -> str:
+    """The one plotly.js <script> shared by every chart in the report."""
+    if source == 'cdn':
+        version = get_plotlyjs_version()
+        return f'<script src="https://cdn.plot.ly/plotly-{version}.min.js" charset="utf-8"></script>'
+    return f'<script type="text/javascript">{get_plotlyjs()}</script>'
+
+def _figure_payload(fig) -> str:
+    raw = pio.to_json(fig, validate=False).encode('utf-8')
+    return base64.b64encode(gzip.compress(raw, compresslevel=9)).decode('ascii')
+
+def downsample_series(s: pd.Series, max_points: int = 1500) -> pd.Series:
+    """Average consecutive buckets so a sorted series has at most `max_points` points."""
+    if len(s) <= max_points:
+        return s
+    buckets = np.arange(len(s)) * max_points // len(s)
+    starts = np.flatnonzero(np.r_[True, np.diff(buckets) != 0])
+    counts = np.diff(np.r_[starts, len(s)])
+    values = np.add.reduceat(s.to_numpy(dtype=float), starts) / counts
+    return pd.Series(values, index=s.index[starts], name=s.name)
+
+def _downsample_figure(fig, max_points: int = 1500):
+    """Copy of `fig` with every trace longer than `max_points` bucket-averaged."""
+    fig = go.Figure(fig)
+    for trace in fig.data:
+        if trace.y is not None and len(trace.y) > max_points:
+            x = trace.x if trace.x is not None else np.arange(len(trace.y))
+            s = downsample_series(pd.Series(np.asarray(trace.y, dtype=float), index=pd.Index(x)), max_points)
+            trace.update(x=s.index.to_numpy(), y=s.to_numpy())
+    return fig
+
+def remember_for_dataset(key: str, fingerprint: str, value):
+    """Keep `value` in the session, tagged with the `dataset_fingerprint` it was built from."""
+    st.session_state[key] = (fingerprint, value)
+
+def recall_for_dataset(key: str, fingerprint: str):
+    """Return the value stored by `remember_for_dataset` only if its fingerprint matches."""
+    stored = st.session_state.get(key)
+    if stored is None or stored[0] != fingerprint:
+        return None
+    return stored[1]
+
+def _table_html(df: pd.DataFrame, max_rows: int = 200) -> str:
+    return df.head(max_rows).to_html(float_format=lambda v: f"{v:,.2f}", border=0)
+
+def create_html_report(df: pd.DataFrame, insights: list, totals=None, stat=None, insights_result=None,
+                       date_col=None, kpi_cols=None, corr=None, pivot=None, forecast=None, plotly_source='inline'):
+    """Build a self-contained interactive HTML dashboard.
+
+    Only aggregates go into the file: KPIs, the stats table, pivots,
+    per-date KPI sums (downsampled), branch revenue and the forecast.
+    Results the dashboard already computed on this run (`totals`, `stat`,
+    `corr`, `insights_result`) are passed in rather than recomputed.
+    """
+    sections = []
+
+    if totals is not None:
+        totals_dict, grand = totals
+        cards = [_KPI_TEMPLATE.substitute(label=escape(str(k)), value=f"{v:,.2f}") for k, v in totals_dict.items()]
+        cards.append(_KPI_TEMPLATE.substitute(label=escape(t('grand_total')), value=f"{grand:,.2f}"))
+        sections.append(_SECTION_TEMPLATE.substitute(heading='KPIs', body=f'<div class="kpis">{"".join(cards)}</div>'))
+
+    if insights:
+        items = ''.join('<li>' + _BOLD_RE.sub(r'<b>\1</b>', escape(str(ins))) + '</li>' for ins in insights)
+        sections.append(_SECTION_TEMPLATE.substitute(heading=escape(t('insights')), body=f'<ul>{items}</ul>'))
+
+    if stat is not None and not stat.empty:
+        sections.append(_SECTION_TEMPLATE.substitute(heading=escape(t('stats_summary')), body=_table_html(stat)))
+
+    charts = []
+    kpi_cols = [c for c in (kpi_cols or []) if c in df.columns and pd.api.types.is_numeric_dtype(df[c])]
+    if date_col and kpi_cols:
+        dates = pd.to_datetime(df[date_col], errors='coerce')
+        by_date = df[kpi_cols].groupby(dates).sum().sort_index()
+        fig = go.Figure()
+        for c in kpi_cols:
+            s = downsample_series(by_date[c])
+            fig.add_trace(go.Scatter(x=s.index, y=s.to_numpy(dtype=float), mode='lines', name=str(c)))
+        fig.update_layout(title=f"{', '.join(map(str, kpi_cols))} by {date_col}", xaxis_title=date_col)
+        charts.append(fig)
+
+    if insights_result and insights_result.get('branch_revenue') is not None:
+        branch_revenue = insights_result['branch_revenue'].sort_values(ascending=False)
+        fig = go.Figure(go.Bar(x=branch_revenue.index.astype(str), y=branch_revenue.to_numpy(dtype=float)))
+        fig.update_layout(title="Branch Performance")
+        charts.append(fig)
+
+    if corr is not None:
+        charts.append(go.Figure(go.Heatmap(z=corr.to_numpy(), x=corr.columns, y=corr.index, zmin=-1, zmax=1)))
+
+    if charts:
+        body = ''.join(_FIGURE_TEMPLATE.substitute(payload=_figure_payload(f)) for f in charts)
+        sections.append(_SECTION_TEMPLATE.substitute(heading=escape(t('charts')), body=body))
+
+    if insights_result and insights_result.get('tree') is not None:
+        level = insights_result['drill_levels'][0]
+        top = rollup_children(insights_result['tree'], (), level)
+        sections.append(_SECTION_TEMPLATE.substitute(heading=escape(t('drilldown')), body=_table_html(top)))
+
+    if pivot is not None:
+        sections.append(_SECTION_TEMPLATE.substitute(heading=escape(t('pivot_config')), body=_table_html(pivot)))
+
+    if forecast is not None:
+        fc_fig, forecast_df = forecast
+        # The history trace can hold every raw row; embed it downsampled
+        body = _FIGURE_TEMPLATE.substitute(payload=_figure_payload(_downsample_figure(fc_fig))) + _table_html(forecast_df)
+        sections.append(_SECTION_TEMPLATE.substitute(heading=escape(t('forecasting')), body=body))
+
+    lang = st.session_state.get('lang', 'en')
+    html_doc = _REPORT_TEMPLATE.substitute(
+        lang=lang,
+        direction='rtl' if lang == 'ar' else 'ltr',
+        title=escape(t('title')),
+        plotly=_plotly_bundle(plotly_source) if charts or forecast is not None else '',
+        generated=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        rows=f"{df.shape[0]:,}",
+        columns=df.shape[1],
+        sections='\n'.join(sections),
+        loader=_FIGURE_LOADER,
+    )
+    return html_doc.encode('utf-8')
 
 # ---------------- Streamlit App ----------------
 st.set_page_config(page_title='Sales Insights', layout='wide')
@@ -246,6 +1208,9 @@ with st.sidebar:
     lang = st.selectbox(t('language'), options=['English', 'Arabic'])
     st.session_state['lang'] = 'ar' if lang == 'Arabic' else 'en'
     dark = st.checkbox(t('theme'))
+    approx = st.checkbox(t('approx_mode'))
+    compact = st.checkbox(t('compact_mode'))
+    memory_budget = st.number_input(t('memory_budget'), min_value=0, value=500, step=100)
 
 if dark:
     st.markdown("""
@@ -263,7 +1228,13 @@ with col1:
     load_sample = st.button(t('load_sample'))
     show_raw = st.checkbox(t('show_data'))
 
-    if uploaded:
+    sketches = None
+    if uploaded and approx and uploaded.name.lower().endswith('.csv'):
+        # Approximate mode: sketches are built while the CSV is read in chunks
+        df, sketches = read_csv_with_sketches(uploaded.getvalue())
+        if df is None:
+            df = read_file(uploaded)
+    elif uploaded:
         df = read_file(uploaded)
     elif load_sample:
         df = pd.DataFrame({
@@ -276,11 +1247,22 @@ with col1:
     else:
         df = None
 
+    memory_report = None
+    if df is not None:
+        df, memory_report = compact_if_needed(df, float(memory_budget), compact)
+
+    # Other sources are sketched once after loading, chunk by chunk, and cached
+    if approx and df is not None and sketches is None:
+        sketches = build_sketches(df)
+
 with col2:
     if df is None:
         st.info('No data loaded — upload your Excel/CSV (e.g., the provided مبيعات file).')
     else:
         st.success('Data loaded')
+        if memory_report is not None:
+            with st.expander(t('memory_report')):
+                st.dataframe(memory_report.round({'MB before': 2, 'MB after': 2, 'saved %': 1}))
         # Manual selections
         all_cols = df.columns.tolist()
         st.subheader('Configuration')
@@ -291,19 +1273,26 @@ with col2:
 
         numeric_cols = st.multiselect(t('kpi_selection'), options=all_cols, default=[c for c in all_cols if pd.api.types.is_numeric_dtype(df[c])][:3])
 
+        # ---------------------------------------------------------------
+        # ⚡ Independent sections (totals, stats, insights, missing values,
+        # correlations) are computed concurrently; each one is rendered into
+        # its own slot as soon as its result is ready.
+        # ---------------------------------------------------------------
+        sections = SectionExecutor({
+            'totals': lambda: grand_totals(df),
+            'stats': lambda: approx_stats_summary(sketches) if sketches else stats_summary(df),
+            'insights': lambda: compute_insights(df),
+            'missing': lambda: df.isna().sum(),
+            'correlations': lambda: correlation_matrix(df),
+        }, timeouts=SECTION_TIMEOUTS)
+        slots = {}
+
         # Totals and KPIs
         # ---------------------------------------------------------------
         # 🧮 Totals and KPIs (Global totals + Selected totals)
         # ---------------------------------------------------------------
         st.subheader("🔹 " + t('total_everything') + " — جميع الأعمدة الرقمية")
-        
-        # --- Global Totals (all numeric columns) ---
-        totals_dict_all, grand_all = grand_totals(df)
-        kpi_cols_display = list(totals_dict_all.keys())[:4]
-        kpi_cols = st.columns(len(kpi_cols_display) if kpi_cols_display else 1)
-        for i, k in enumerate(kpi_cols_display):
-            kpi_cols[i].metric(k, f"{totals_dict_all[k]:,.2f}")
-        st.markdown(f"**{t('grand_total')}:** {grand_all:,.2f}")
+        slots['totals'] = st.container()
         
         st.markdown("---")
         
@@ -326,128 +1315,14 @@ with col2:
 
         # Stats summary
         st.subheader(t('stats_summary'))
-        stat = stats_summary(df)
-        if not stat.empty:
-            st.dataframe(stat)
-        else:
-            st.info('No numeric columns for statistics')
+        slots['stats'] = st.container()
 
         # Insights
         # =====================================
         # 🤖 Automated Insights (Smart Summary + Table + Chart)
         # =====================================
-        import pandas as pd
-        import numpy as np
-        import streamlit as st
-        import plotly.express as px
-        
         st.header("🤖 Automated Insights")
-        
-        try:
-            # --- Initialize safe list ---
-            insights = []
-        
-            # --- Helper function to find columns (Arabic or English) ---
-            def safe_find(df, possible_names):
-                for name in possible_names:
-                    for col in df.columns:
-                        if str(col).strip().lower() == str(name).strip().lower():
-                            return col
-                return None
-        
-            # --- Detect key columns dynamically ---
-            revenue_col = safe_find(df, ["القيمة بعد الضريبة", "صافي المبيعات", "الإيرادات", "revenue", "total revenue"])
-            discount_col = safe_find(df, ["الخصومات", "خصم", "discount", "total discount"])
-            tax_col = safe_find(df, ["الضريبة", "ضريبة الصنف", "tax", "total tax"])
-            qty_col = safe_find(df, ["الكمية", "كمية كرتون", "quantity", "total quantity"])
-            branch_col = safe_find(df, ["الفرع", "branch"])
-            salesman_col = safe_find(df, ["اسم المندوب", "مندوب", "salesman"])
-            product_col = safe_find(df, ["اسم الصنف", "الصنف", "product"])
-        
-            # --- Prepare summary dictionary ---
-            insights_dict = {}
-        
-            # --- Calculate totals ---
-            if revenue_col in df.columns:
-                total_revenue = df[revenue_col].sum()
-                insights_dict["Total Revenue"] = f"{total_revenue:,.2f}"
-                insights.append(f"💰 Total Revenue: {total_revenue:,.2f}")
-        
-            if discount_col in df.columns:
-                total_discount = df[discount_col].sum()
-                insights_dict["Total Discounts"] = f"{total_discount:,.2f}"
-                insights.append(f"🎯 Total Discounts: {total_discount:,.2f}")
-        
-            if tax_col in df.columns:
-                total_tax = df[tax_col].sum()
-                insights_dict["Total Tax"] = f"{total_tax:,.2f}"
-                insights.append(f"💸 Total Tax: {total_tax:,.2f}")
-        
-            if qty_col in df.columns:
-                total_qty = df[qty_col].sum()
-                insights_dict["Total Quantity"] = f"{total_qty:,.2f}"
-                insights.append(f"📦 Total Quantity: {total_qty:,.2f}")
-        
-            # --- Find top categories ---
-            if branch_col in df.columns and revenue_col in df.columns:
-                top_branch = df.groupby(branch_col)[revenue_col].sum().idxmax()
-                insights_dict["Top Branch by Revenue"] = str(top_branch)
-                insights.append(f"🏢 Top Branch by Revenue: {top_branch}")
-        
-            if salesman_col in df.columns and revenue_col in df.columns:
-                top_salesman = df.groupby(salesman_col)[revenue_col].sum().idxmax()
-                insights_dict["Top Salesman"] = str(top_salesman)
-                insights.append(f"🧍‍♂️ Top Salesman: {top_salesman}")
-        
-            if product_col in df.columns and revenue_col in df.columns:
-                top_product = df.groupby(product_col)[revenue_col].sum().idxmax()
-                insights_dict["Top Product"] = str(top_product)
-                insights.append(f"🛒 Top Product: {top_product}")
-        
-            # --- Optional correlation check (for numeric relationships) ---
-            num = df.select_dtypes(include=[np.number])
-            if num.shape[1] >= 2:
-                corr = num.corr().abs()
-                corr_unstack = corr.where(~np.eye(corr.shape[0], dtype=bool)).unstack().dropna()
-                if not corr_unstack.empty:
-                    top_pair = corr_unstack.sort_values(ascending=False).index[0]
-                    top_val = corr_unstack.sort_values(ascending=False).iloc[0]
-                    insights.append(f"📈 Strongest correlation between **{top_pair[0]}** and **{top_pair[1]}**: {top_val:.2f}")
-        
-            # --- Display the results ---
-            st.markdown("### 📊 Summary of Key Metrics")
-            col1, col2 = st.columns([1.3, 2])
-        
-            # --- Left: Table of metrics ---
-            with col1:
-                if insights_dict:
-                    insights_df = pd.DataFrame(list(insights_dict.items()), columns=["Metric", "Value"])
-                    st.table(insights_df)
-                else:
-                    st.info("⚠️ لم يتم العثور على بيانات كافية لإنشاء التحليل التلقائي.")
-        
-            # --- Right: Textual insights ---
-            with col2:
-                st.markdown("### 💡 Key Observations")
-                for ins in insights:
-                    st.write("- ", ins)
-        
-            # --- Chart: Revenue by Branch (if available) ---
-            if revenue_col and branch_col:
-                st.markdown("### 🏢 Revenue by Branch")
-                fig = px.bar(
-                    df.groupby(branch_col)[revenue_col].sum().reset_index(),
-                    x=branch_col,
-                    y=revenue_col,
-                    title="Branch Performance",
-                    color=branch_col,
-                    text_auto=".2s"
-                )
-                fig.update_layout(showlegend=False)
-                st.plotly_chart(fig, use_container_width=True)
-        
-        except Exception as e:
-            st.error(f"⚠️ Error generating insights: {e}")
+        slots['insights'] = st.container()
 
             
         
@@ -471,51 +1346,43 @@ with col2:
         x_axes = st.multiselect("🧭 " + t('x_axis'), options=chart_cols, default=[chart_cols[0]] if chart_cols else [])
         y_axes = st.multiselect("📈 " + t('y_axis'), options=chart_cols, default=[chart_cols[1]] if len(chart_cols) > 1 else [])
         
+        combine_series = st.checkbox(t('combine_series'), value=False)
+
         if st.button(t('plot')):
             try:
-                fig = None
+                figs = []
+                spec_key = None
         
                 if chart_type in ['Line', 'Bar', 'Area', 'Scatter']:
                     if not x_axes or not y_axes:
                         st.warning('يرجى اختيار عمود واحد على الأقل للمحور السيني والمحور الصادي.')
                     else:
-                        for y_col in y_axes:
-                            if chart_type == 'Line':
-                                fig = px.line(df, x=x_axes[0], y=y_col, title=f"{chart_type} Chart - {y_col}")
-                            elif chart_type == 'Bar':
-                                fig = px.bar(df, x=x_axes[0], y=y_col, title=f"{chart_type} Chart - {y_col}")
-                            elif chart_type == 'Area':
-                                fig = px.area(df, x=x_axes[0], y=y_col, title=f"{chart_type} Chart - {y_col}")
-                            elif chart_type == 'Scatter':
-                                fig = px.scatter(df, x=x_axes[0], y=y_col, title=f"{chart_type} Chart - {y_col}")
-                            st.plotly_chart(fig, use_container_width=True)
+                        spec_key = (x_axes[0], tuple(y_axes))
         
                 elif chart_type == 'Box':
                     if not y_axes:
                         st.warning('يرجى اختيار عمود واحد على الأقل للمحور الصادي.')
                     else:
-                        fig = px.box(df, y=y_axes)
-                        st.plotly_chart(fig, use_container_width=True)
+                        spec_key = (None, tuple(y_axes))
         
                 elif chart_type == 'Pie':
                     if not y_axes:
                         st.warning('يرجى اختيار عمود للقيم.')
                     else:
-                        for y_col in y_axes:
-                            names = x_axes[0] if x_axes else df.columns[0]
-                            fig = px.pie(df, names=names, values=y_col, title=f"مخطط دائري: {y_col}")
-                            st.plotly_chart(fig, use_container_width=True)
+                        spec_key = (x_axes[0] if x_axes else df.columns[0], tuple(y_axes))
         
                 elif chart_type == 'Heatmap':
                     num = df.select_dtypes(include=[np.number])
                     if num.shape[1] < 2:
                         st.warning('تحتاج على الأقل إلى عمودين رقميين لرسم خريطة حرارية.')
                     else:
-                        corr = num.corr()
-                        import plotly.graph_objects as go
-                        fig = go.Figure(data=go.Heatmap(z=corr.values, x=corr.columns, y=corr.index, zmin=-1, zmax=1))
-                        fig.update_layout(title="خريطة الارتباط الحرارية")
-                        st.plotly_chart(fig, use_container_width=True)
+                        spec_key = (None, ())
+
+                if spec_key is not None:
+                    figs = build_chart_figures(df, dataset_fingerprint(df), chart_type,
+                                               spec_key[0], spec_key[1], combine_series)
+                for fig in figs:
+                    st.plotly_chart(fig, use_container_width=True)
         
             except Exception as e:
                 st.error(f"تعذر إنشاء المخطط: {e}")
@@ -531,6 +1398,7 @@ with col2:
             pvt = generate_pivot(df, rows=pivot_rows, cols=pivot_cols if pivot_cols else None, values=pivot_value if pivot_value != '' else None, aggfunc=pivot_agg)
             if pvt is not None:
                 st.dataframe(pvt)
+                remember_for_dataset('last_pivot', dataset_fingerprint(df), pvt)
                 # allow download
                 excel_bytes = df_to_excel_bytes({'pivot': pvt.reset_index()})
                 st.download_button(t('download_pivot'), data=excel_bytes, file_name='pivot_table.xlsx')
@@ -623,6 +1491,7 @@ with col2:
                             st.plotly_chart(fig, use_container_width=True)
                             st.subheader(('Forecast Table' if st.session_state.get('lang','en')=='en' else 'جدول التنبؤ'))
                             st.dataframe(forecast_df.reset_index(drop=True))
+                            remember_for_dataset('last_forecast', dataset_fingerprint(df), (fig, forecast_df.reset_index(drop=True)))
                     else:
                         # No date column provided: forecast on index sequence
                         series = df[fc_col].dropna().astype(float)
@@ -665,21 +1534,83 @@ with col2:
                             ))
                             st.plotly_chart(fig, use_container_width=True)
                             st.dataframe(forecast_df)
+                            remember_for_dataset('last_forecast', dataset_fingerprint(df), (fig, forecast_df))
                 except Exception as e:
                     st.error(f'Forecasting failed: {e}')
 
         # Missing values & correlations
         st.markdown('---')
         st.subheader(t('missing_values'))
-        miss = df.isna().sum()
-        st.dataframe(miss[miss>0])
+        slots['missing'] = st.container()
 
         st.subheader(t('correlations'))
-        num_df = df.select_dtypes(include=[np.number])
-        if num_df.shape[1] >= 2:
-            st.dataframe(num_df.corr())
-        else:
-            st.info('Not enough numeric columns for correlations')
+        slots['correlations'] = st.container()
+
+        # Render each concurrent section as it finishes; a failing or slow
+        # section only affects its own slot.
+        stat = pd.DataFrame()
+        insights = []
+        totals_result = None
+        insights_result = None
+        corr_result = None
+        for name, result, error in sections.as_completed():
+            with slots[name]:
+                if error is not None:
+                    if name == 'insights':
+                        st.error(f"⚠️ Error generating insights: {error}")
+                    else:
+                        st.error(f"⚠️ {name}: {error}")
+                    continue
+
+                if name == 'totals':
+                    totals_result = result
+                    totals_dict_all, grand_all = result
+                    kpi_cols_display = list(totals_dict_all.keys())[:4]
+                    kpi_cols = st.columns(len(kpi_cols_display) if kpi_cols_display else 1)
+                    for i, k in enumerate(kpi_cols_display):
+                        kpi_cols[i].metric(k, f"{totals_dict_all[k]:,.2f}")
+                    st.markdown(f"**{t('grand_total')}:** {grand_all:,.2f}")
+
+                elif name == 'stats':
+                    stat = result
+                    if not stat.empty:
+                        st.dataframe(stat)
+                    else:
+                        st.info('No numeric columns for statistics')
+                    if sketches:
+                        st.caption(t('approx_note'))
+                        with st.expander(t('sketch_check')):
+                            if st.button(t('run_sketch_check')):
+                                st.dataframe(sketch_accuracy(df))
+                        top_rows = []
+                        for col, sk in sketches.items():
+                            if sk.numeric:
+                                continue
+                            for value, count in sk.frequent.top(3).items():
+                                top_rows.append({'Column': col, 'Value': value, 'Count ≈': int(count),
+                                                 'Count err ≤': int(sk.frequent.error),
+                                                 'Distinct ≈': round(sk.distinct.count())})
+                        if top_rows:
+                            st.markdown('**' + t('top_values') + '**')
+                            st.dataframe(pd.DataFrame(top_rows))
+
+                elif name == 'insights':
+                    insights = result['insights']
+                    insights_result = result
+                    try:
+                        render_insights(result)
+                    except Exception as e:
+                        st.error(f"⚠️ Error generating insights: {e}")
+
+                elif name == 'missing':
+                    st.dataframe(result[result > 0])
+
+                elif name == 'correlations':
+                    corr_result = result
+                    if result is not None:
+                        st.dataframe(result)
+                    else:
+                        st.info('Not enough numeric columns for correlations')
 
         # Export reports
         st.markdown('---')
@@ -689,9 +1620,7 @@ with col2:
         # ================================================================
         st.subheader("📄 Export as PDF")
         
-        if "df" in st.session_state:
-            df = st.session_state["df"]
-        
+        if df is not None:
             # Generate PDF button
             if st.button("📥 Download Full Report (PDF)"):
                 buffer = BytesIO()
@@ -733,7 +1662,10 @@ with col2:
                 p.setFont("Helvetica", 10)
         
                 for col in df.select_dtypes(exclude=['number']).columns[:3]:
-                    top_val = df[col].value_counts().idxmax()
+                    if sketches and col in sketches and sketches[col].frequent is not None:
+                        top_val = sketches[col].frequent.top(1).index[0] + " (≈)"
+                    else:
+                        top_val = df[col].value_counts().idxmax()
                     p.drawString(1.2 * inch, y, f"{col}: {top_val}")
                     y -= 0.25 * inch
                     if y < 1.2 * inch:
@@ -766,9 +1698,22 @@ with col2:
             except Exception as e:
                 st.error(f'Export failed: {e}')
 
+        html_from_cdn = st.checkbox(t('html_cdn'))
         if st.button(t('download_html')):
             try:
-                html_b = create_html_report(df, insights)
+                fingerprint = dataset_fingerprint(df)
+                html_b = create_html_report(
+                    df, insights,
+                    totals=totals_result,
+                    stat=stat,
+                    insights_result=insights_result,
+                    date_col=date_col,
+                    kpi_cols=numeric_cols,
+                    corr=corr_result,
+                    pivot=recall_for_dataset('last_pivot', fingerprint),
+                    forecast=recall_for_dataset('last_forecast', fingerprint),
+                    plotly_source='cdn' if html_from_cdn else 'inline',
+                )
                 fname = f'sales_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.html'
                 st.download_button('Download HTML report', data=html_b, file_name=fname, mime='text/html')
             except Exception as e: